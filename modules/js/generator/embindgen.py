@@ -68,7 +68,7 @@
 ###############################################################################
 
 from __future__ import print_function
-import sys, re, os
+import sys, re, os, hashlib, pickle
 from templates import *
 
 if sys.version_info[0] >= 3:
@@ -80,18 +80,18 @@ else:
 func_table = {}
 
 # Ignore these functions due to Embind limitations for now
-ignore_list = ['locate',  #int&
-               'minEnclosingCircle',  #float&
-               'checkRange',
-               'minMaxLoc',   #double*
-               'floodFill', # special case, implemented in core_bindings.cpp
-               'phaseCorrelate',
-               'randShuffle',
-               'calibrationMatrixValues', #double&
-               'undistortPoints', # global redefinition
-               'CamShift', #Rect&
-               'meanShift' #Rect&
-               ]
+ignore_list = frozenset(['locate',  #int&
+                         'minEnclosingCircle',  #float&
+                         'checkRange',
+                         'minMaxLoc',   #double*
+                         'floodFill', # special case, implemented in core_bindings.cpp
+                         'phaseCorrelate',
+                         'randShuffle',
+                         'calibrationMatrixValues', #double&
+                         'undistortPoints', # global redefinition
+                         'CamShift', #Rect&
+                         'meanShift' #Rect&
+                         ])
 
 def makeWhiteList(module_list):
     wl = {}
@@ -111,6 +111,7 @@ export_consts = True
 with_wrapped_functions = True
 with_default_params = True
 with_vec_from_js_array = True
+vec_from_js_array_types = frozenset(['int', 'float', 'double', 'char', 'uchar', 'String', 'std::string'])
 
 wrapper_namespace = "Wrappers"
 type_dict = {
@@ -123,8 +124,12 @@ type_dict = {
     'const String&':'const std::string&'
 }
 
+re_cv_prefix = re.compile(r"^cv\.")
+re_const_vector_ref = re.compile(r'const std::vector<(.*)>&')
+re_vector = re.compile(r'std::vector<(.*)>')
+
 def normalize_class_name(name):
-    return re.sub(r"^cv\.", "", name).replace(".", "_")
+    return re_cv_prefix.sub("", name).replace(".", "_")
 
 
 class ClassProp(object):
@@ -253,6 +258,7 @@ class FuncVariant(object):
         self.rettype = handle_vector(handle_ptr(decl[1]).strip()).strip()
         if self.rettype == "void":
             self.rettype = ""
+        self.ptrret = "Ptr<" in self.rettype
         self.args = []
         self.array_counters = {}
 
@@ -301,6 +307,13 @@ class JSWrapperGenerator(object):
         self.parser = hdr_parser.CppHeaderParser()
         self.class_idx = 0
 
+        self.cache_dir = os.environ.get('OPENCV_JS_HDR_CACHE_DIR',
+                                        os.path.join(os.path.expanduser('~'), '.cache', 'opencv-jsgen'))
+        self.parser_hash = None
+
+        self.wrapper_ret_types = {}
+        self.binding_ret_types = {}
+
     def add_class(self, stype, name, decl):
         class_info = ClassInfo(name, decl)
         class_info.decl_idx = self.class_idx
@@ -429,6 +442,40 @@ class JSWrapperGenerator(object):
         f.write(buf.getvalue())
         f.close()
 
+    def get_wrapper_ret_type(self, rettype):
+        # type_dict is complete once the headers are parsed, so the mapping
+        # of each distinct return type only has to be computed once
+        ret_type = self.wrapper_ret_types.get(rettype)
+        if ret_type is None:
+            ret_type = 'void' if rettype.strip() == '' else rettype
+            if ret_type.startswith('Ptr'): #smart pointer
+                ptr_type = ret_type.replace('Ptr<', '').replace('>', '')
+                ret_type = type_dict.get(ptr_type, ret_type)
+            for key in type_dict:
+                if key in ret_type:
+                    ret_type = ret_type.replace(key, type_dict[key])
+            self.wrapper_ret_types[rettype] = ret_type
+        return ret_type
+
+    def get_binding_ret_type(self, rettype):
+        ret_type = self.binding_ret_types.get(rettype)
+        if ret_type is None:
+            ret_type = 'void' if rettype.strip() == '' else rettype
+
+            ret_type = ret_type.strip()
+
+            if ret_type.startswith('Ptr'): #smart pointer
+                ptr_type = ret_type.replace('Ptr<', '').replace('>', '')
+                ret_type = type_dict.get(ptr_type, ret_type)
+            for key in type_dict:
+                if key in ret_type:
+                    # Replace types. Instead of ret_type.replace we use regular
+                    # expression to exclude false matches.
+                    # See https://github.com/opencv/opencv/issues/15514
+                    ret_type = re.sub('(^|[^\w])' + key + '($|[^\w])', type_dict[key], ret_type)
+            self.binding_ret_types[rettype] = ret_type
+        return ret_type
+
     def gen_function_binding_with_wrapper(self, func, class_info):
 
         binding_text = None
@@ -440,7 +487,7 @@ class JSWrapperGenerator(object):
         for index, variant in enumerate(func.variants):
 
             factory = False
-            if class_info and 'Ptr<' in variant.rettype:
+            if class_info and variant.ptrret:
 
                 factory = True
                 base_class_name = variant.rettype
@@ -455,23 +502,12 @@ class JSWrapperGenerator(object):
             has_def_param = False
 
             # Return type
-            ret_type = 'void' if variant.rettype.strip() == '' else variant.rettype
-            if ret_type.startswith('Ptr'): #smart pointer
-                ptr_type = ret_type.replace('Ptr<', '').replace('>', '')
-                if ptr_type in type_dict:
-                    ret_type = type_dict[ptr_type]
-            for key in type_dict:
-                if key in ret_type:
-                    ret_type = ret_type.replace(key, type_dict[key])
+            ret_type = self.get_wrapper_ret_type(variant.rettype)
 
             arg_types = []
             unwrapped_arg_types = []
             for arg in variant.args:
-                arg_type = None
-                if arg.tp in type_dict:
-                    arg_type = type_dict[arg.tp]
-                else:
-                    arg_type = arg.tp
+                arg_type = type_dict.get(arg.tp, arg.tp)
                 # Add default value
                 if with_default_params and arg.defval != '':
                     def_args.append(arg.defval);
@@ -480,7 +516,7 @@ class JSWrapperGenerator(object):
 
             # Function attribure
             func_attribs = ''
-            if '*' in ''.join(arg_types):
+            if any('*' in arg_type for arg_type in arg_types):
                 func_attribs += ', allow_raw_pointers()'
 
             if variant.is_pure_virtual:
@@ -505,14 +541,15 @@ class JSWrapperGenerator(object):
             casted_arg_types = []
             for arg_type, arg_name in zip(arg_types, raw_arg_names):
                 casted_arg_name = arg_name
-                if with_vec_from_js_array:
+                # most arguments are not vectors, skip the regex for them
+                if with_vec_from_js_array and 'std::vector<' in arg_type:
                     # Only support const vector reference as input parameter
-                    match = re.search(r'const std::vector<(.*)>&', arg_type)
+                    match = re_const_vector_ref.search(arg_type)
                     if match:
                         type_in_vect = match.group(1)
-                        if type_in_vect in ['int', 'float', 'double', 'char', 'uchar', 'String', 'std::string']:
+                        if type_in_vect in vec_from_js_array_types:
                             casted_arg_name = 'emscripten::vecFromJSArray<' + type_in_vect + '>(' + arg_name + ')'
-                            arg_type = re.sub(r'std::vector<(.*)>', 'emscripten::val', arg_type)
+                            arg_type = re_vector.sub('emscripten::val', arg_type)
                 w_signature.append(arg_type + ' ' + arg_name)
                 arg_names.append(casted_arg_name)
                 casted_arg_types.append(arg_type)
@@ -537,16 +574,16 @@ class JSWrapperGenerator(object):
                 # Wrapper
                 if factory: # TODO or static
                     name = class_info.cname+'::' if variant.class_name else ""
-                    cpp_call_text = static_class_call_template.substitute(scope=name,
+                    cpp_call_text = static_class_call_template.format(scope=name,
                                                                    func=func.cname,
                                                                    args=', '.join(arg_names[:len(arg_names)-j]))
                 elif class_info:
-                    cpp_call_text = class_call_template.substitute(obj='arg0',
-                                                                   func=func.cname,
-                                                                   args=', '.join(arg_names[:len(arg_names)-j]))
+                    cpp_call_text = class_call_template.format(obj='arg0',
+                                                               func=func.cname,
+                                                               args=', '.join(arg_names[:len(arg_names)-j]))
                 else:
-                    cpp_call_text = call_template.substitute(func=func.cname,
-                                                             args=', '.join(arg_names[:len(arg_names)-j]))
+                    cpp_call_text = call_template.format(func=func.cname,
+                                                         args=', '.join(arg_names[:len(arg_names)-j]))
 
 
                 wrapper_func_text = wrapper_function_template.substitute(ret_val=ret_type,
@@ -571,7 +608,7 @@ class JSWrapperGenerator(object):
                             # e.g. DescriptorMatcher
                             continue
                         class_info.constructor_arg_num.add(args_num)
-                        binding_text = ctr_template.substitute(const='const' if variant.is_const else '',
+                        binding_text = ctr_template.format(const='const' if variant.is_const else '',
                                                            cpp_name=c_func_name+postfix,
                                                            ret=ret_type,
                                                            args=','.join(arg_types[:len(arg_types)-j]),
@@ -579,14 +616,14 @@ class JSWrapperGenerator(object):
                     else:
                         binding_template = overload_class_static_function_template if variant.is_class_method else \
                             overload_class_function_template
-                        binding_text = binding_template.substitute(js_name=js_func_name,
+                        binding_text = binding_template.format(js_name=js_func_name,
                                                            const='' if variant.is_const else '',
                                                            cpp_name=c_func_name+postfix,
                                                            ret=ret_type,
                                                            args=','.join(arg_types[:len(arg_types)-j]),
                                                            optional=func_attribs)
                 else:
-                    binding_text = overload_function_template.substitute(js_name=js_func_name,
+                    binding_text = overload_function_template.format(js_name=js_func_name,
                                                        cpp_name=c_func_name+postfix,
                                                        const='const' if variant.is_const else '',
                                                        ret=ret_type,
@@ -624,20 +661,7 @@ class JSWrapperGenerator(object):
 
 
             # Return type
-            ret_type = 'void' if variant.rettype.strip() == '' else variant.rettype
-
-            ret_type = ret_type.strip()
-
-            if ret_type.startswith('Ptr'): #smart pointer
-                ptr_type = ret_type.replace('Ptr<', '').replace('>', '')
-                if ptr_type in type_dict:
-                    ret_type = type_dict[ptr_type]
-            for key in type_dict:
-                if key in ret_type:
-                    # Replace types. Instead of ret_type.replace we use regular
-                    # expression to exclude false matches.
-                    # See https://github.com/opencv/opencv/issues/15514
-                    ret_type = re.sub('(^|[^\w])' + key + '($|[^\w])', type_dict[key], ret_type)
+            ret_type = self.get_binding_ret_type(variant.rettype)
             if variant.constret and ret_type.startswith('const') == False:
                 ret_type = 'const ' + ret_type
             if variant.refret and ret_type.endswith('&') == False:
@@ -647,10 +671,7 @@ class JSWrapperGenerator(object):
             orig_arg_types = []
             def_args = []
             for arg in variant.args:
-                if arg.tp in type_dict:
-                    arg_type = type_dict[arg.tp]
-                else:
-                    arg_type = arg.tp
+                arg_type = type_dict.get(arg.tp, arg.tp)
 
                 #if arg.outputarg:
                 #    arg_type += '&'
@@ -661,7 +682,7 @@ class JSWrapperGenerator(object):
 
             # Function attribure
             func_attribs = ''
-            if '*' in ''.join(orig_arg_types):
+            if any('*' in arg_type for arg_type in orig_arg_types):
                 func_attribs += ', allow_raw_pointers()'
 
             if variant.is_pure_virtual:
@@ -682,20 +703,20 @@ class JSWrapperGenerator(object):
                 if j > 0:
                     postfix = '_' + str(j);
                 if factory:
-                    binding_text = ctr_template.substitute(const='const' if variant.is_const else '',
-                                                           cpp_name=c_func_name+postfix,
-                                                           ret=ret_type,
-                                                           args=','.join(arg_types[:len(arg_types)-j]),
-                                                           optional=func_attribs)
+                    binding_text = ctr_template.format(const='const' if variant.is_const else '',
+                                                       cpp_name=c_func_name+postfix,
+                                                       ret=ret_type,
+                                                       args=','.join(arg_types[:len(arg_types)-j]),
+                                                       optional=func_attribs)
                 else:
                     binding_template = overload_class_static_function_template if variant.is_class_method else \
                             overload_function_template if class_info == None else overload_class_function_template
-                    binding_text = binding_template.substitute(js_name=js_func_name,
-                                                               const='const' if variant.is_const else '',
-                                                               cpp_name=c_func_name+postfix,
-                                                               ret=ret_type,
-                                                               args=','.join(arg_types[:len(arg_types)-1]),
-                                                               optional=func_attribs)
+                    binding_text = binding_template.format(js_name=js_func_name,
+                                                           const='const' if variant.is_const else '',
+                                                           cpp_name=c_func_name+postfix,
+                                                           ret=ret_type,
+                                                           args=','.join(arg_types[:len(arg_types)-1]),
+                                                           optional=func_attribs)
 
                 binding_text_list.append(binding_text)
 
@@ -714,11 +735,55 @@ class JSWrapperGenerator(object):
                 else:
                     print()
 
+    def parse_header(self, hdr):
+        """
+        Parses the header with hdr_parser, reusing the result of a previous run
+        if neither the header nor hdr_parser.py have changed since then.
+        """
+        if self.parser_hash is None:
+            parser_src = os.path.splitext(hdr_parser.__file__)[0] + '.py'
+            with open(parser_src, 'rb') as f:
+                self.parser_hash = hashlib.sha256(f.read()).hexdigest()
+
+        with open(hdr, 'rb') as f:
+            key = hashlib.sha256(f.read() + self.parser_hash.encode('ascii')).hexdigest()
+        cache_file = os.path.join(self.cache_dir, key + '.pkl')
+
+        entry = None
+        if os.path.isfile(cache_file):
+            try:
+                with open(cache_file, 'rb') as f:
+                    entry = pickle.load(f)
+            except Exception:
+                entry = None
+
+        if entry is None:
+            # hdr_parser collects namespaces as a side effect of parse(),
+            # so keep those of this header together with its declarations
+            namespaces = self.parser.namespaces
+            self.parser.namespaces = set()
+            try:
+                decls = self.parser.parse(hdr)
+                entry = (decls, self.parser.namespaces)
+            finally:
+                self.parser.namespaces = namespaces
+            try:
+                if not os.path.isdir(self.cache_dir):
+                    os.makedirs(self.cache_dir)
+                with open(cache_file, 'wb') as f:
+                    pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+            except (IOError, OSError):
+                pass  # the cache is an optimization only
+
+        decls, namespaces = entry
+        self.parser.namespaces |= namespaces
+        return decls
+
     def gen(self, dst_file, src_files, core_bindings):
         # step 1: scan the headers and extract classes, enums and functions
         headers = []
         for hdr in src_files:
-            decls = self.parser.parse(hdr)
+            decls = self.parse_header(hdr)
             # print(hdr);
             # self.print_decls(decls);
             if len(decls) == 0:
@@ -738,46 +803,75 @@ class JSWrapperGenerator(object):
                 else:  # class/global function
                     self.add_func(decl)
 
+        # only namespaces under cv are exported
+        cv_namespaces = [(ns_name, ns) for ns_name, ns in sorted(self.namespaces.items())
+                         if ns_name == 'cv' or ns_name.startswith('cv.')]
+
         # step 2: generate bindings
-        # Global functions
-        for ns_name, ns in sorted(self.namespaces.items()):
-            if ns_name.split('.')[0] != 'cv':
-                continue
+        # Global functions, enums and constants are collected in a single pass
+        # over the namespaces. Enums and constants are emitted after the classes.
+        enum_bindings = []
+        const_bindings = []
+        for ns_name, ns in cv_namespaces:
             for name, func in sorted(ns.funcs.items()):
                 if name in ignore_list:
                     continue
                 if not name in white_list['']:
                     continue
 
-                ext_cnst = False
                 # Check if the method is an external constructor
-                for variant in func.variants:
-                    if "Ptr<" in variant.rettype:
-
+                ext_cnst_variants = [variant for variant in func.variants if variant.ptrret]
+                if ext_cnst_variants:
+                    class_name = func.name.replace("create", "")
+                    for variant in ext_cnst_variants:
                         # Register the smart pointer
                         base_class_name = variant.rettype
                         base_class_name = base_class_name.replace("Ptr<","").replace(">","").strip()
                         self.classes[base_class_name].has_smart_ptr = True
 
                         # Adds the external constructor
-                        class_name = func.name.replace("create", "")
                         if not class_name in self.classes:
                             self.classes[base_class_name].methods[func.cname] = func
                         else:
                             self.classes[class_name].methods[func.cname] = func
-                        ext_cnst = True
-                if ext_cnst:
                     continue
 
                 if with_wrapped_functions:
                     binding, wrapper = self.gen_function_binding_with_wrapper(func, class_info=None)
-                    self.bindings += binding
-                    self.wrapper_funcs += wrapper
+                    self.bindings.extend(binding)
+                    self.wrapper_funcs.extend(wrapper)
                 else:
                     binding = self.gen_function_binding(func, class_info=None)
-                    self.bindings+=binding
+                    self.bindings.extend(binding)
+
+            if export_enums:
+                # step 4: generate bindings for enums
+                # TODO anonymous enums are ignored for now.
+                for name, enum in sorted(ns.enums.items()):
+                    if not name.endswith('.anonymous'):
+                        name = name.replace("cv.", "")
+                        enum_values = []
+                        for enum_val in enum:
+                            value = enum_val[0][enum_val[0].rfind(".")+1:]
+                            enum_values.append(enum_item_template.format(val=value,
+                                                                         cpp_val=name.replace('.', '::')+'::'+value))
+
+                        enum_bindings.append(enum_template.substitute(cpp_name=name.replace(".", "::"),
+                                                                      js_name=name.replace(".", "_"),
+                                                                      enum_items=''.join(enum_values)))
+                    else:
+                        print(name)
+                        #TODO: represent anonymous enums with constants
+
+            if export_consts:
+                # step 5: generate bindings for consts
+                for name, const in sorted(ns.consts.items()):
+                    # print("Gen consts: ", name, const)
+                    const_bindings.append(const_template.format(js_name=name, value=const))
 
         # generate code for the classes and their methods
+        # NB: classes are not independent here - factory methods set has_smart_ptr
+        # on other classes, so this loop has to stay sequential and sorted
         for name, class_info in sorted(self.classes.items()):
             class_bindings = []
             if not name in white_list:
@@ -793,26 +887,26 @@ class JSWrapperGenerator(object):
                     for variant in method.variants:
                         args = []
                         for arg in variant.args:
-                            arg_type = type_dict[arg.tp] if arg.tp in type_dict else arg.tp
+                            arg_type = type_dict.get(arg.tp, arg.tp)
                             args.append(arg_type)
                         # print('Constructor: ', class_info.name, len(variant.args))
                         args_num = len(variant.args)
                         if args_num in class_info.constructor_arg_num:
                             continue
                         class_info.constructor_arg_num.add(args_num)
-                        class_bindings.append(constructor_template.substitute(signature=', '.join(args)))
+                        class_bindings.append(constructor_template.format(signature=', '.join(args)))
                 else:
                     if with_wrapped_functions and (len(method.variants) > 1 or len(method.variants[0].args)>0 or "String" in method.variants[0].rettype):
                         binding, wrapper = self.gen_function_binding_with_wrapper(method, class_info=class_info)
-                        self.wrapper_funcs = self.wrapper_funcs + wrapper
-                        class_bindings = class_bindings + binding
+                        self.wrapper_funcs.extend(wrapper)
+                        class_bindings.extend(binding)
                     else:
                         binding = self.gen_function_binding(method, class_info=class_info)
-                        class_bindings = class_bindings + binding
+                        class_bindings.extend(binding)
 
             # Regiseter Smart pointer
             if class_info.has_smart_ptr:
-                class_bindings.append(smart_ptr_reg_template.substitute(cname=class_info.cname, name=class_info.name))
+                class_bindings.append(smart_ptr_reg_template.format(cname=class_info.cname, name=class_info.name))
 
             # Attach external constructors
             # for method_name, method in class_info.ext_constructors.items():
@@ -824,68 +918,39 @@ class JSWrapperGenerator(object):
             # Generate bindings for properties
             for property in class_info.props:
                 _class_property = class_property_enum_template if property.tp in type_dict else class_property_template
-                class_bindings.append(_class_property.substitute(js_name=property.name, cpp_name='::'.join(
+                class_bindings.append(_class_property.format(js_name=property.name, cpp_name='::'.join(
                     [class_info.cname, property.name])))
 
             dv = ''
-            base = Template("""base<$base>""")
-
             assert len(class_info.bases) <= 1 , "multiple inheritance not supported"
 
             if len(class_info.bases) == 1:
-                dv = "," + base.substitute(base=', '.join(class_info.bases))
+                dv = "," + base_template.format(base=', '.join(class_info.bases))
 
             self.bindings.append(class_template.substitute(cpp_name=class_info.cname,
                                                            js_name=name,
                                                            class_templates=''.join(class_bindings),
                                                            derivation=dv))
 
-        if export_enums:
-            # step 4: generate bindings for enums
-            # TODO anonymous enums are ignored for now.
-            for ns_name, ns in sorted(self.namespaces.items()):
-                if ns_name.split('.')[0] != 'cv':
-                    continue
-                for name, enum in sorted(ns.enums.items()):
-                    if not name.endswith('.anonymous'):
-                        name = name.replace("cv.", "")
-                        enum_values = []
-                        for enum_val in enum:
-                            value = enum_val[0][enum_val[0].rfind(".")+1:]
-                            enum_values.append(enum_item_template.substitute(val=value,
-                                                                             cpp_val=name.replace('.', '::')+'::'+value))
-
-                        self.bindings.append(enum_template.substitute(cpp_name=name.replace(".", "::"),
-                                                                      js_name=name.replace(".", "_"),
-                                                                      enum_items=''.join(enum_values)))
-                    else:
-                        print(name)
-                        #TODO: represent anonymous enums with constants
-
-        if export_consts:
-            # step 5: generate bindings for consts
-            for ns_name, ns in sorted(self.namespaces.items()):
-                if ns_name.split('.')[0] != 'cv':
-                    continue
-                for name, const in sorted(ns.consts.items()):
-                    # print("Gen consts: ", name, const)
-                    self.bindings.append(const_template.substitute(js_name=name, value=const))
+        self.bindings.extend(enum_bindings)
+        self.bindings.extend(const_bindings)
 
         with open(core_bindings) as f:
             ret = f.read()
 
         header_includes = '\n'.join(['#include "{}"'.format(hdr) for hdr in headers])
-        ret = ret.replace('@INCLUDES@', header_includes)
+        ret = [ret.replace('@INCLUDES@', header_includes)]
 
         defis = '\n'.join(self.wrapper_funcs)
-        ret += wrapper_codes_template.substitute(ns=wrapper_namespace, defs=defis)
-        ret += emscripten_binding_template.substitute(binding_name='testBinding', bindings=''.join(self.bindings))
+        ret.append(wrapper_codes_template.substitute(ns=wrapper_namespace, defs=defis))
+        ret.append(emscripten_binding_template.substitute(binding_name='testBinding', bindings=''.join(self.bindings)))
 
 
         # print(ret)
-        text_file = open(dst_file, "w")
-        text_file.write(ret)
-        text_file.close()
+        # encode once and write in binary mode, bypassing the text layer
+        # (this also keeps '\n' line endings on every platform)
+        with open(dst_file, "wb") as f:
+            f.write(''.join(ret).encode('utf-8'))
 
 
 if __name__ == "__main__":
@@ -909,6 +974,8 @@ if __name__ == "__main__":
     whiteListFile = sys.argv[5]
     exec(open(whiteListFile).read())
     assert(white_list)
+    # the white list is only used for membership tests
+    white_list = dict((k, frozenset(v)) for k, v in white_list.items())
 
     generator = JSWrapperGenerator()
     generator.gen(bindingsCpp, headers, coreBindings)
@@ -71,9 +71,11 @@ from string import Template
 
 wrapper_codes_template = Template("namespace $ns {\n$defs\n}")
 
-call_template = Template("""$func($args)""")
-class_call_template = Template("""$obj.$func($args)""")
-static_class_call_template = Template("""$scope$func($args)""")
+# Templates expanded once per binding are plain str.format() patterns rather than
+# string.Template, which is noticeably slower on the hot path.
+call_template = """{func}({args})"""
+class_call_template = """{obj}.{func}({args})"""
+static_class_call_template = """{scope}{func}({args})"""
 
 wrapper_function_template = Template("""    $ret_val $func($signature)$const {
         return $cpp_call;
@@ -136,28 +138,28 @@ simple_function_template = Template("""
     emscripten::function("$js_name", &$cpp_name);
 """)
 
-smart_ptr_reg_template = Template("""
-        .smart_ptr<Ptr<$cname>>("Ptr<$name>")
-""")
+smart_ptr_reg_template = """
+        .smart_ptr<Ptr<{cname}>>("Ptr<{name}>")
+"""
 
-overload_function_template = Template("""
-    function("$js_name", select_overload<$ret($args)$const>(&$cpp_name)$optional);
-""")
+overload_function_template = """
+    function("{js_name}", select_overload<{ret}({args}){const}>(&{cpp_name}){optional});
+"""
 
-overload_class_function_template = Template("""
-        .function("$js_name", select_overload<$ret($args)$const>(&$cpp_name)$optional)""")
+overload_class_function_template = """
+        .function("{js_name}", select_overload<{ret}({args}){const}>(&{cpp_name}){optional})"""
 
-overload_class_static_function_template = Template("""
-        .class_function("$js_name", select_overload<$ret($args)$const>(&$cpp_name)$optional)""")
+overload_class_static_function_template = """
+        .class_function("{js_name}", select_overload<{ret}({args}){const}>(&{cpp_name}){optional})"""
 
-class_property_template = Template("""
-        .property("$js_name", &$cpp_name)""")
+class_property_template = """
+        .property("{js_name}", &{cpp_name})"""
 
-class_property_enum_template = Template("""
-        .property("$js_name", binding_utils::underlying_ptr(&$cpp_name))""")
+class_property_enum_template = """
+        .property("{js_name}", binding_utils::underlying_ptr(&{cpp_name}))"""
 
-ctr_template = Template("""
-        .constructor(select_overload<$ret($args)$const>(&$cpp_name)$optional)""")
+ctr_template = """
+        .constructor(select_overload<{ret}({args}){const}>(&{cpp_name}){optional})"""
 
 smart_ptr_ctr_overload_template = Template("""
         .smart_ptr_constructor("$ptr_type", select_overload<$ret($args)$const>(&$cpp_name)$optional)""")
@@ -168,19 +170,19 @@ function_template = Template("""
 static_function_template = Template("""
         .class_function("$js_name", &$cpp_name)""")
 
-constructor_template = Template("""
-        .constructor<$signature>()""")
+constructor_template = """
+        .constructor<{signature}>()"""
 
-enum_item_template = Template("""
-        .value("$val", $cpp_val)""")
+enum_item_template = """
+        .value("{val}", {cpp_val})"""
 
 enum_template = Template("""
     emscripten::enum_<$cpp_name>("$js_name")$enum_items;
 """)
 
-const_template = Template("""
-    constant("$js_name", static_cast<long>($value));
-""")
+const_template = """
+    constant("{js_name}", static_cast<long>({value}));
+"""
 
 vector_template = Template("""
      emscripten::register_vector<$cType>("$js_name");
@@ -190,6 +192,8 @@ map_template = Template("""
      emscripten::register_map<cpp_type_key,$cpp_type_val>("$js_name");
 """)
 
+base_template = """base<{base}>"""
+
 class_template = Template("""
     emscripten::class_<$cpp_name $derivation>("$js_name")$class_templates;
 """)